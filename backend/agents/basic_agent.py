@@ -2,8 +2,9 @@
 Basic demo LangGraph agent with simple tool-like calls and conditional routing.
 
 This agent cycles through a small graph of nodes:
-- random: generate a random number
-- timestamp: capture current UNIX timestamp
+- random / timestamp: fan out in parallel to generate a random number and
+  capture the current UNIX timestamp
+- decide: join point once both have run
 - branch_a / branch_b: take different branches based on the random value
 - loop/end decision: continue looping for a few iterations or end
 
@@ -12,12 +13,14 @@ Note: This is intentionally simple and does not wire into the EffectLogger yet.
 
 from __future__ import annotations
 
+import functools
+import operator
 import random
 import time
-from typing import Literal, TypedDict
+from typing import Annotated, Literal, TypedDict
 
 from langgraph.checkpoint.memory import InMemorySaver
-from langgraph.graph import END, StateGraph
+from langgraph.graph import END, START, StateGraph
 from services.observe import (
     compile_with_checkpointer,
     instrument_node,
@@ -33,7 +36,8 @@ class BasicAgentState(TypedDict, total=False):
     - step: loop counter incremented on each branch
     - random_value: last generated random float in [0, 1)
     - timestamp: last captured UNIX timestamp
-    - path: list of node names taken (for observability)
+    - path: list of node names taken (for observability); concatenated across
+      parallel branches by its reducer
     - max_steps: stop condition when step >= max_steps
     - done: True when the graph decides to end
     """
@@ -41,7 +45,7 @@ class BasicAgentState(TypedDict, total=False):
     step: int
     random_value: float | None
     timestamp: float | None
-    path: list[str]
+    path: Annotated[list[str], operator.add]
     max_steps: int
     done: bool
 
@@ -57,12 +61,17 @@ def _initial_state(max_steps: int) -> BasicAgentState:
     }
 
 
+# Module-private generator: seeding it for replays leaves the global
+# `random` state untouched
+_RNG = random.Random()
+
+
 # --- Simple tool-like functions (no external APIs) ---
 @instrument_tool("random", kind="tool")
 def _tool_random() -> float:
     """Generate a random number in [0, 1)."""
 
-    return random.random()
+    return _RNG.random()
 
 
 @instrument_tool("timestamp", kind="tool")
@@ -73,38 +82,38 @@ def _tool_timestamp() -> float:
 
 
 # --- Graph nodes ---
+# Nodes return partial updates: random and timestamp run concurrently, and the
+# `path` reducer appends each node's entry instead of overwriting the list.
 @instrument_node("random")
 def _node_random(state: BasicAgentState) -> BasicAgentState:
     value = _tool_random()
-    state["random_value"] = value
-    state.setdefault("path", []).append("random")
-    return state
+    return {"random_value": value, "path": ["random"]}
 
 
 @instrument_node("timestamp")
 def _node_timestamp(state: BasicAgentState) -> BasicAgentState:
     ts = _tool_timestamp()
-    state["timestamp"] = ts
-    state.setdefault("path", []).append("timestamp")
-    return state
+    return {"timestamp": ts, "path": ["timestamp"]}
+
+
+@instrument_node("decide")
+def _node_decide(state: BasicAgentState) -> BasicAgentState:
+    # Join point for the random/timestamp fan-out; routing happens on its edges
+    return {}
 
 
 @instrument_node("branch_a")
 def _node_branch_a(state: BasicAgentState) -> BasicAgentState:
-    state["step"] = int(state.get("step", 0)) + 1
-    state.setdefault("path", []).append("branch_a")
-    return state
+    return {"step": int(state.get("step", 0)) + 1, "path": ["branch_a"]}
 
 
 @instrument_node("branch_b")
 def _node_branch_b(state: BasicAgentState) -> BasicAgentState:
-    state["step"] = int(state.get("step", 0)) + 1
-    state.setdefault("path", []).append("branch_b")
-    return state
+    return {"step": int(state.get("step", 0)) + 1, "path": ["branch_b"]}
 
 
 # --- Routing helpers ---
-@instrument_router("timestamp")
+@instrument_router("decide")
 def _choose_branch(state: BasicAgentState) -> Literal["branch_a", "branch_b"]:
     """Decide which branch to take based on the random value."""
 
@@ -113,8 +122,10 @@ def _choose_branch(state: BasicAgentState) -> Literal["branch_a", "branch_b"]:
 
 
 @instrument_router("branch_decision")
-def _route_after_branch(state: BasicAgentState) -> Literal["continue", "end"]:
-    """Decide whether to continue looping or end the graph."""
+def _route_after_branch(
+    state: BasicAgentState,
+) -> list[Literal["random", "timestamp"]] | Literal["end"]:
+    """Decide whether to continue looping (fanning out again) or end the graph."""
 
     step = int(state.get("step", 0))
     max_steps = int(state.get("max_steps", 3))
@@ -122,33 +133,33 @@ def _route_after_branch(state: BasicAgentState) -> Literal["continue", "end"]:
         state["done"] = True
         state.setdefault("path", []).append("end")
         return "end"
-    return "continue"
-
+    return ["random", "timestamp"]
 
-def build_basic_agent(*, checkpointer: object | None = None):
-    """Build and compile the demo graph.
 
-    Returns a compiled LangGraph app which can be invoked with a state dict.
-    """
+@functools.cache
+def _build_graph() -> StateGraph:
+    """Build the (uncompiled) demo graph once; compiling it does not mutate it."""
 
-    with record_stategraph_build():
-        graph = StateGraph(BasicAgentState)
+    with record_stategraph_build() as (_, recording_state_graph):
+        graph = recording_state_graph(BasicAgentState)
 
     # Nodes
     graph.add_node("random", _node_random)
     graph.add_node("timestamp", _node_timestamp)
+    graph.add_node("decide", _node_decide)
     graph.add_node("branch_a", _node_branch_a)
     graph.add_node("branch_b", _node_branch_b)
 
-    # Entry
-    graph.set_entry_point("random")
+    # Entry: random and timestamp are independent, so run them in parallel
+    graph.add_edge(START, "random")
+    graph.add_edge(START, "timestamp")
 
-    # Linear edge random -> timestamp
-    graph.add_edge("random", "timestamp")
+    # Fan-in: decide waits for both parallel nodes
+    graph.add_edge(["random", "timestamp"], "decide")
 
-    # Conditional: from timestamp, choose which branch to take
+    # Conditional: from decide, choose which branch to take
     graph.add_conditional_edges(
-        "timestamp",
+        "decide",
         _choose_branch,
         {
             "branch_a": "branch_a",
@@ -162,14 +173,33 @@ def build_basic_agent(*, checkpointer: object | None = None):
             branch,
             _route_after_branch,
             {
-                "continue": "random",  # loop back to generate new random + timestamp
+                # loop back to generate new random + timestamp in parallel
+                "random": "random",
+                "timestamp": "timestamp",
                 "end": END,  # finish
             },
         )
 
+    return graph
+
+
+@functools.cache
+def _compiled_app():
+    # Without a checkpointer the compiled app holds no per-run state, so one
+    # instance can serve every invocation
+    return _build_graph().compile()
+
+
+def build_basic_agent(*, checkpointer: object | None = None):
+    """Build and compile the demo graph.
+
+    Returns a compiled LangGraph app which can be invoked with a state dict.
+    The graph is built once; only apps with a checkpointer are compiled per call.
+    """
+
     if checkpointer is not None:
-        return compile_with_checkpointer(graph, checkpointer=checkpointer)
-    return graph.compile()
+        return compile_with_checkpointer(_build_graph(), checkpointer=checkpointer)
+    return _compiled_app()
 
 
 def build_basic_agent_with_memory_checkpointer():
@@ -186,7 +216,7 @@ def run_basic_agent(max_steps: int = 10, seed: int | None = None) -> BasicAgentS
     """
 
     if seed is not None:
-        random.seed(seed)
+        _RNG.seed(seed)
     # Register graph and start a run
     app = build_basic_agent()
     state = _initial_state(max_steps)
@@ -1,136 +1,294 @@
 from __future__ import annotations
 
-from dataclasses import asdict
+import asyncio
+import threading
+from collections import OrderedDict
+from collections.abc import Iterator
 from typing import Any
 from uuid import UUID, uuid4
 
+import orjson
 from agents.basic_agent import (
     build_basic_agent_with_memory_checkpointer,
     run_basic_agent,
 )
+from database.engine import get_session
 from database.repositories import RunRepository, SpanRepository
 from domain.models import Run as RunDom
 from domain.models import Span as SpanDom
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from jsonpatch import make_patch
-from services.observe import RECORDED_SPANS, span_context
+from services.observe import drain_recorded_spans, span_context, to_unix_seconds
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 router = APIRouter()
 
+# Serialized /diff bodies for pairs of completed runs. Completed runs' spans
+# never change, so an entry stays valid until one of the runs is deleted.
+_DIFF_CACHE_MAXSIZE = 512
+_DIFF_CACHE: OrderedDict[tuple[UUID, UUID], bytes] = OrderedDict()
+# Streamed diff bodies are cached from threadpool workers
+_DIFF_CACHE_LOCK = threading.Lock()
 
-@router.get("/diff")
-def diff_runs(left: UUID, right: UUID) -> JSONResponse:
-    """Compute a structural diff between two runs' spans.
 
-    Matching strategy (first pass):
-    - Pair spans by (kind, name, node_id, fingerprint) when possible.
-    - Report unmatched on either side for visibility.
-    - For matched pairs, compute JSON Patch diffs for relevant structured attrs:
-      * node spans: before_state, after_state
-      * other spans: request, response
-    """
+def _diff_cache_get(key: tuple[UUID, UUID]) -> bytes | None:
+    with _DIFF_CACHE_LOCK:
+        body = _DIFF_CACHE.get(key)
+        if body is not None:
+            _DIFF_CACHE.move_to_end(key)
+        return body
 
-    def _safe(obj: Any) -> Any:
-        return obj if obj is not None else None
 
-    def _patch(a: Any, b: Any) -> list[dict[str, Any]]:
+def _diff_cache_put(key: tuple[UUID, UUID], body: bytes) -> None:
+    with _DIFF_CACHE_LOCK:
+        _DIFF_CACHE[key] = body
+        _DIFF_CACHE.move_to_end(key)
+        if len(_DIFF_CACHE) > _DIFF_CACHE_MAXSIZE:
+            _DIFF_CACHE.popitem(last=False)
+
+
+def _diff_cache_invalidate(run_id: UUID) -> None:
+    with _DIFF_CACHE_LOCK:
+        for key in [k for k in _DIFF_CACHE if run_id in k]:
+            del _DIFF_CACHE[key]
+
+
+def _pointer_token(key: Any) -> str:
+    # JSON Pointer escaping (RFC 6901)
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def _same_json(a: Any, b: Any) -> bool:
+    # `==` alone treats 1, 1.0 and True as equal, hiding type changes; equal
+    # containers are confirmed by their encodings, which tell those apart
+    if a is b:
+        return True
+    if a != b:
+        return False
+    if isinstance(a, (dict, list)):
         try:
-            patch = make_patch(_safe(a), _safe(b))
-            return list(patch.patch)
+            return orjson.dumps(a, option=orjson.OPT_NON_STR_KEYS) == orjson.dumps(
+                b, option=orjson.OPT_NON_STR_KEYS
+            )
         except Exception:
-            return []
+            return False
+    return type(a) is type(b)
 
-    left_run = RunRepository.get_or_none(left)
-    right_run = RunRepository.get_or_none(right)
-    if not left_run or not right_run:
-        raise HTTPException(status_code=404, detail="one or both runs not found")
 
-    left_spans = SpanRepository.list_for_run(left)
-    right_spans = SpanRepository.list_for_run(right)
+def _json_patch(a: Any, b: Any, path: str = "") -> list[dict[str, Any]]:
+    """RFC 6902 patch turning `a` into `b`, diffing dicts key by key.
 
-    def _key(s: SpanDom) -> tuple[str, str, str | None, str]:
-        return (s.kind, s.name, s.node_id, s.fingerprint)
+    Equal subtrees are pruned with a C-level `==` (plus an encoding check
+    when it holds), so jsonpatch's recursive pure-Python diff only runs on
+    lists that actually changed.
+    """
 
-    left_by_key: dict[tuple[str, str, str | None, str], SpanDom] = {
-        _key(s): s for s in left_spans
-    }
-    right_by_key: dict[tuple[str, str, str | None, str], SpanDom] = {
-        _key(s): s for s in right_spans
+    if _same_json(a, b):
+        return []
+    if isinstance(a, dict) and isinstance(b, dict):
+        ops: list[dict[str, Any]] = []
+        for key, a_value in a.items():
+            key_path = path + "/" + _pointer_token(key)
+            if key not in b:
+                ops.append({"op": "remove", "path": key_path})
+            else:
+                ops.extend(_json_patch(a_value, b[key], key_path))
+        for key, b_value in b.items():
+            if key not in a:
+                key_path = path + "/" + _pointer_token(key)
+                ops.append({"op": "add", "path": key_path, "value": b_value})
+        return ops
+    if isinstance(a, list) and isinstance(b, list):
+        if a == b:
+            # Equal but for scalar types, which jsonpatch compares with `==`
+            # too: diff index by index
+            ops = []
+            for i, (a_item, b_item) in enumerate(zip(a, b)):
+                ops.extend(_json_patch(a_item, b_item, f"{path}/{i}"))
+            return ops
+        ops = list(make_patch(a, b).patch)
+        for op in ops:
+            op["path"] = path + op["path"]
+            if "from" in op:
+                op["from"] = path + op["from"]
+        return ops
+    return [{"op": "replace", "path": path, "value": b}]
+
+
+def _patch(a: Any, b: Any) -> list[dict[str, Any]]:
+    try:
+        return _json_patch(a, b)
+    except Exception:
+        return []
+
+
+def _matched_item(ls: dict[str, Any], rs: dict[str, Any]) -> dict[str, Any]:
+    """Diff entry for a pair of spans matched by key."""
+
+    # Extract structured fields when present
+    l_attrs = ls["attrs"] or {}
+    r_attrs = rs["attrs"] or {}
+    diffs: dict[str, Any] = {}
+    # Equal content hashes mean identical attrs: every patch is empty
+    same = ls["content_hash"] == rs["content_hash"]
+    if same and ls["kind"] == "node":
+        diffs["before_state_patch"] = []
+        diffs["after_state_patch"] = []
+    elif same:
+        diffs["request_patch"] = []
+        diffs["response_patch"] = []
+    elif ls["kind"] == "node":
+        diffs["before_state_patch"] = _patch(
+            l_attrs.get("before_state"), r_attrs.get("before_state")
+        )
+        diffs["after_state_patch"] = _patch(
+            l_attrs.get("after_state"), r_attrs.get("after_state")
+        )
+    else:
+        diffs["request_patch"] = _patch(l_attrs.get("request"), r_attrs.get("request"))
+        diffs["response_patch"] = _patch(
+            l_attrs.get("response"), r_attrs.get("response")
+        )
+
+    return {
+        "kind": ls["kind"],
+        "name": ls["name"],
+        "node_id": ls["node_id"],
+        "fingerprint": ls["fingerprint"],
+        "left": ls,
+        "right": rs,
+        "diffs": diffs,
     }
 
-    matched_keys = list(set(left_by_key.keys()) & set(right_by_key.keys()))
-    only_left_keys = list(set(left_by_key.keys()) - set(right_by_key.keys()))
-    only_right_keys = list(set(right_by_key.keys()) - set(left_by_key.keys()))
-
-    matched: list[dict[str, Any]] = []
-    for k in sorted(matched_keys):
-        ls = left_by_key[k]
-        rs = right_by_key[k]
-        # Extract structured fields when present
-        l_attrs = ls.attrs or {}
-        r_attrs = rs.attrs or {}
-        diffs: dict[str, Any] = {}
-        if ls.kind == "node":
-            diffs["before_state_patch"] = _patch(
-                l_attrs.get("before_state"), r_attrs.get("before_state")
-            )
-            diffs["after_state_patch"] = _patch(
-                l_attrs.get("after_state"), r_attrs.get("after_state")
-            )
-        else:
-            diffs["request_patch"] = _patch(
-                l_attrs.get("request"), r_attrs.get("request")
-            )
-            diffs["response_patch"] = _patch(
-                l_attrs.get("response"), r_attrs.get("response")
-            )
 
-        matched.append(
-            {
-                "kind": ls.kind,
-                "name": ls.name,
-                "node_id": ls.node_id,
-                "fingerprint": ls.fingerprint,
-                "left": asdict(ls),
-                "right": asdict(rs),
-                "diffs": diffs,
-            }
-        )
+@router.get("/diff")
+async def diff_runs(
+    left: UUID, right: UUID, session: AsyncSession = Depends(get_session)
+) -> Response:
+    """Compute a structural diff between two runs' spans.
 
-    def _compact_span(s: SpanDom) -> dict[str, Any]:
-        d = asdict(s)
-        # keep essential identifying info for unmatched sets
-        return {
-            "id": d.get("id"),
-            "kind": d.get("kind"),
-            "name": d.get("name"),
-            "node_id": d.get("node_id"),
-            "fingerprint": d.get("fingerprint"),
-        }
+    Matching strategy (first pass):
+    - Pair spans by (kind, name, node_id, fingerprint) when possible; the
+      pairing is a single SQL join (see `SpanRepository.diff_pairs`).
+    - Report unmatched on either side for visibility.
+    - For matched pairs, compute JSON Patch diffs for relevant structured attrs:
+      * node spans: before_state, after_state
+      * other spans: request, response
+
+    The response is one JSON object, streamed: everything but `matched` is
+    sent first, then each matched entry as soon as its patches are computed.
+    Results for two completed runs are cached as serialized bytes.
+    """
 
-    only_left = [_compact_span(left_by_key[k]) for k in sorted(only_left_keys)]
-    only_right = [_compact_span(right_by_key[k]) for k in sorted(only_right_keys)]
+    cached = _diff_cache_get((left, right))
+    if cached is not None:
+        return Response(cached, media_type="application/json")
 
-    payload = {
+    left_run = await RunRepository.get_or_none(left, session=session)
+    right_run = await RunRepository.get_or_none(right, session=session)
+    if not left_run or not right_run:
+        raise HTTPException(status_code=404, detail="one or both runs not found")
+
+    # Pairing happens in the database; unmatched spans come back id + key only
+    pairs = await SpanRepository.diff_pairs(left, right, session=session)
+    only_left, only_right = await SpanRepository.diff_unmatched(
+        left, right, session=session
+    )
+
+    head = {
         "ok": True,
-        "left_run": asdict(left_run),
-        "right_run": asdict(right_run),
+        "left_run": left_run.to_dict(),
+        "right_run": right_run.to_dict(),
         "summary": {
-            "matched": len(matched),
+            "matched": len(pairs),
             "only_left": len(only_left),
             "only_right": len(only_right),
         },
-        "matched": matched,
         "only_left": only_left,
         "only_right": only_right,
     }
+    cacheable = left_run.status == "completed" and right_run.status == "completed"
+
+    def _body() -> Iterator[bytes]:
+        # Plain generator: StreamingResponse iterates it in the threadpool, so
+        # diffing the matched pairs never blocks the event loop. Reopen the head
+        # object and append the matched array item by item
+        chunks = [orjson.dumps(head, option=orjson.OPT_NON_STR_KEYS)[:-1]]
+        chunks.append(b',"matched":[')
+        yield b"".join(chunks)
+        for i, (ls, rs) in enumerate(pairs):
+            item = orjson.dumps(
+                _matched_item(ls, rs),
+                option=orjson.OPT_NON_STR_KEYS,
+            )
+            chunk = item if i == 0 else b"," + item
+            if cacheable:
+                chunks.append(chunk)
+            yield chunk
+        chunks.append(b"]}")
+        yield b"]}"
+        if cacheable:
+            _diff_cache_put((left, right), b"".join(chunks))
+
+    return StreamingResponse(_body(), media_type="application/json")
+
+
+def _stream_graph(
+    app: Any, config: dict[str, Any], run_id: UUID, max_steps: int, policy: str
+) -> None:
+    # Ensure spans are tagged with this run_id/policy for all nested tool/node spans
+    with span_context(
+        run_id=str(run_id), node_id=None, checkpoint_id=None, policy=policy
+    ):
+        for _ in app.stream(
+            {"max_steps": max_steps, "path": []}, config, stream_mode="values"
+        ):
+            pass
 
-    return JSONResponse(payload)
+
+async def _execute_run(
+    run: RunDom, app: Any, config: dict[str, Any], max_steps: int
+) -> None:
+    """Run the graph for a created run, then persist its spans and final status."""
+
+    try:
+        # The LangGraph run is blocking; keep it off the event loop
+        await asyncio.to_thread(
+            _stream_graph, app, config, UUID(run.id), max_steps, run.policy or "strict"
+        )
+        # Draining waits on the span exporter, so it also stays off the loop
+        recorded = await asyncio.to_thread(drain_recorded_spans, run.id)
+        spans = [
+            SpanDom(
+                id=str(uuid4()),
+                run_id=run.id,
+                node_id=s.node_id,
+                checkpoint_id=s.checkpoint_id,
+                kind=s.kind,
+                name=s.name,
+                start_ts=to_unix_seconds(s.start),
+                end_ts=None if s.end is None else to_unix_seconds(s.end),
+                fingerprint=s.fingerprint,
+                attrs=s.serialize_attrs(),
+            )
+            for s in recorded
+        ]
+        run.status = "completed"
+        await SpanRepository.bulk_create(spans, run=run)
+    except Exception:  # pragma: no cover - simple demo flow
+        await asyncio.to_thread(drain_recorded_spans, run.id)
+        run.status = "failed"
+        await RunRepository.update(run)
+        raise
 
 
 @router.post("/start")
-def start_run(payload: dict[str, Any]) -> JSONResponse:
+async def start_run(
+    payload: dict[str, Any],
+    background_tasks: BackgroundTasks,
+    session: AsyncSession = Depends(get_session),
+) -> ORJSONResponse:
     thread_id = str(payload.get("thread_id") or uuid4())
     max_steps = int(payload.get("max_steps") or 5)
     policy = str(payload.get("policy") or "strict")
@@ -148,79 +306,67 @@ def start_run(payload: dict[str, Any]) -> JSONResponse:
         policy=policy,
         meta_data={},
     )
-    RunRepository.create(run)
+    await RunRepository.create(run, session=session)
+    # Make the running status visible before the graph executes in the background
+    await session.commit()
 
-    # Execute by streaming values to generate checkpoints
+    # Execute by streaming values to generate checkpoints; clients poll /runs/{id}
     config = {"configurable": {"thread_id": thread_id}}
-    try:
-        # Ensure spans are tagged with this run_id/policy for all nested tool/node spans
-        with span_context(
-            run_id=str(run_id), node_id=None, checkpoint_id=None, policy=policy
-        ):
-            for _ in app.stream(
-                {"max_steps": max_steps, "path": []}, config, stream_mode="values"
-            ):
-                pass
-        # Save spans recorded so far for this run and clear in-memory buffer to avoid duplicates
-        for s in list(RECORDED_SPANS):
-            SpanRepository.create(
-                SpanDom(
-                    id=str(uuid4()),
-                    run_id=str(run_id),
-                    node_id=s.node_id,
-                    checkpoint_id=s.checkpoint_id,
-                    kind=s.kind,
-                    name=s.name,
-                    start_ts=s.start,
-                    end_ts=s.end,
-                    fingerprint=s.fingerprint,
-                    attrs=s.attrs,
-                )
-            )
-        RECORDED_SPANS.clear()
-        run.status = "completed"
-        RunRepository.update(run)
-    except Exception as exc:  # pragma: no cover - simple demo flow
-        run.status = "failed"
-        RunRepository.update(run)
-        raise HTTPException(status_code=500, detail=str(exc))
-
-    return JSONResponse({"ok": True, "run_id": str(run_id), "thread_id": thread_id})
+    background_tasks.add_task(_execute_run, run, app, config, max_steps)
+
+    return ORJSONResponse(
+        {
+            "ok": True,
+            "run_id": str(run_id),
+            "thread_id": thread_id,
+            "status": run.status,
+        }
+    )
 
 
 @router.get("")
-def list_runs() -> JSONResponse:
-    runs = RunRepository.list()
-    return JSONResponse({"ok": True, "runs": [asdict(r) for r in runs]})
+async def list_runs(session: AsyncSession = Depends(get_session)) -> ORJSONResponse:
+    runs = await RunRepository.list(session=session)
+    return ORJSONResponse({"ok": True, "runs": [r.to_dict() for r in runs]})
 
 
 @router.get("/{run_id}")
-def get_run(run_id: UUID) -> JSONResponse:
-    run = RunRepository.get_or_none(run_id)
+async def get_run(
+    run_id: UUID, session: AsyncSession = Depends(get_session)
+) -> ORJSONResponse:
+    run = await RunRepository.get_or_none(run_id, session=session)
     if not run:
         raise HTTPException(status_code=404, detail="run not found")
-    return JSONResponse({"ok": True, "run": asdict(run)})
+    return ORJSONResponse({"ok": True, "run": run.to_dict()})
 
 
 @router.get("/{run_id}/spans")
-def list_spans(run_id: UUID) -> JSONResponse:
-    spans = SpanRepository.list_for_run(run_id)
-    return JSONResponse({"ok": True, "spans": [asdict(s) for s in spans]})
+async def list_spans(
+    run_id: UUID, session: AsyncSession = Depends(get_session)
+) -> ORJSONResponse:
+    spans = await SpanRepository.list_for_run_raw(run_id, session=session)
+    return ORJSONResponse({"ok": True, "spans": spans})
 
 
 @router.delete("/{run_id}")
-def delete_run(run_id: UUID) -> JSONResponse:
-    run = RunRepository.get_or_none(run_id)
+async def delete_run(
+    run_id: UUID, session: AsyncSession = Depends(get_session)
+) -> ORJSONResponse:
+    run = await RunRepository.get_or_none(run_id, session=session)
     if not run:
         raise HTTPException(status_code=404, detail="run not found")
     # Delete spans first, then the run
-    SpanRepository.delete_for_run(run_id)
-    RunRepository.delete(run_id)
-    return JSONResponse({"ok": True})
+    await SpanRepository.delete_for_run(run_id, session=session)
+    await RunRepository.delete(run_id, session=session)
+    await session.commit()
+    _diff_cache_invalidate(run_id)
+    return ORJSONResponse({"ok": True})
 
 
 @router.get("/{run_id}/history")
-def get_history(run_id: UUID) -> JSONResponse:
+async def get_history(
+    run_id: UUID, session: AsyncSession = Depends(get_session)
+) -> ORJSONResponse:
     # TODO(prod): Load persisted LangGraph checkpointer state for this run/thread
     #   - Use a durable checkpointer (e.g., SQLiteCheckpointer or custom DB-backed)
     #   - Store and retrieve by thread_id (and optionally run_id namespace)
@@ -241,14 +387,12 @@ def get_history(run_id: UUID) -> JSONResponse:
     #       "spans": spans_by_checkpoint.get(checkpoint_id, []),
     #     } for st in app.get_state_history(config)
     #   ]
-    spans = SpanRepository.list_for_run(run_id)
-    return JSONResponse(
-        {"ok": True, "history": [], "spans": [asdict(s) for s in spans]}
-    )
+    spans = await SpanRepository.list_for_run_raw(run_id, session=session)
+    return ORJSONResponse({"ok": True, "history": [], "spans": spans})
 
 
 @router.post("/{run_id}/replay")
-def replay_run(run_id: UUID, payload: dict[str, Any]) -> JSONResponse:
+async def replay_run(run_id: UUID, payload: dict[str, Any]) -> ORJSONResponse:
     # TODO(prod): Accept checkpoint_id and (optionally) thread_id in payload and resume
     #   - Load app + persisted checkpointer for the run/thread
     #   - Find the matching checkpoint from get_state_history(config)
@@ -261,5 +405,5 @@ def replay_run(run_id: UUID, payload: dict[str, Any]) -> JSONResponse:
     #   - Persist replay as a new branch run (add parent_run_id if needed)
     # Here we simply re-run deterministically by setting fixed max_steps.
     max_steps = int(payload.get("max_steps") or 5)
-    result = run_basic_agent(max_steps=max_steps, seed=42)
-    return JSONResponse({"ok": True, "result": result})
+    result = await asyncio.to_thread(run_basic_agent, max_steps=max_steps, seed=42)
+    return ORJSONResponse({"ok": True, "result": result})
@@ -2,16 +2,20 @@ from datetime import datetime, timezone
 from typing import Any
 from uuid import UUID
 
-from sqlalchemy import JSON
+from sqlalchemy import JSON, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlmodel import Column, Field, SQLModel
 
+# Binary JSONB on Postgres (no re-parse on read, GIN-indexable); plain JSON elsewhere
+_JSON_TYPE = JSON().with_variant(JSONB(), "postgresql")
+
 
 class User(SQLModel, table=True):
     id: UUID = Field(primary_key=True)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     email: str
     password: str
-    meta_data: dict[str, Any] = Field(sa_column=Column(JSON))
+    meta_data: dict[str, Any] = Field(sa_column=Column(_JSON_TYPE))
 
 
 class Run(SQLModel, table=True):
@@ -21,10 +25,19 @@ class Run(SQLModel, table=True):
     status: str
     graph_signature: str | None = None
     policy: str | None = None
-    meta_data: dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSON))
+    meta_data: dict[str, Any] = Field(
+        default_factory=dict, sa_column=Column(_JSON_TYPE)
+    )
 
 
 class Span(SQLModel, table=True):
+    __table_args__ = (
+        # Serves both `WHERE run_id = ?` lookups and the per-run created_at ordering
+        Index("ix_span_run_created", "run_id", "created_at"),
+        # Covers the per-run match-key join used to pair spans of two runs
+        Index("ix_span_run_match", "run_id", "kind", "name", "node_id", "fingerprint"),
+    )
+
     id: UUID = Field(primary_key=True)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     run_id: UUID
@@ -35,4 +48,23 @@ class Span(SQLModel, table=True):
     start_ts: float
     end_ts: float | None = None
     fingerprint: str
-    attrs: dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSON))
+    # Key into SpanContent; indexed so orphaned content can be found on delete
+    content_hash: str = Field(foreign_key="spancontent.content_hash", index=True)
+
+
+class SpanContent(SQLModel, table=True):
+    """Content-addressed span attrs, stored once per distinct attrs payload.
+
+    Replays of a deterministic run reproduce the same attrs, so their spans
+    share a row here instead of each storing its own copy.
+    """
+
+    __table_args__ = (
+        # Containment queries on attrs (e.g. attrs @> '{"status": "error"}')
+        Index("ix_spancontent_attrs_gin", "attrs", postgresql_using="gin").ddl_if(
+            dialect="postgresql"
+        ),
+    )
+
+    content_hash: str = Field(primary_key=True)
+    attrs: dict[str, Any] = Field(default_factory=dict, sa_column=Column(_JSON_TYPE))
@@ -1,17 +1,170 @@
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any
 from uuid import UUID
 from uuid import UUID as UUID_t
 
+import orjson
+import xxhash
+
 from domain.models import Run as RunDom
 from domain.models import Span as SpanDom
 from domain.models import User as UserDom
-from sqlmodel import Session, select
+from sqlalchemy import and_, bindparam, delete, exists, func, insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from database.engine import ENGINE
+from database.engine import SESSION_FACTORY
 from database.models import Run as RunDB
 from database.models import Span as SpanDB
+from database.models import SpanContent as SpanContentDB
 from database.models import User as UserDB
 
 
+@asynccontextmanager
+async def _session_scope(session: AsyncSession | None) -> AsyncIterator[AsyncSession]:
+    """Reuse the caller's (request-scoped) session, or open a short-lived one.
+
+    A borrowed session is committed by its owner; a short-lived session is
+    committed here when the block exits cleanly.
+    """
+    if session is not None:
+        yield session
+        return
+    async with SESSION_FACTORY() as own:
+        yield own
+        await own.commit()
+
+
+# Statements are built once at import and reused with bound parameters, so
+# hot read paths skip per-call select() construction and cache-key generation.
+_SELECT_USERS = select(UserDB).order_by(UserDB.created_at.desc())
+_SELECT_RUNS = select(RunDB).order_by(RunDB.created_at.desc())
+_SELECT_SPANS_BY_RUN = (
+    select(SpanDB, SpanContentDB.attrs)
+    .outerjoin(SpanContentDB, SpanContentDB.content_hash == SpanDB.content_hash)
+    .where(SpanDB.run_id == bindparam("run_id"))
+    .order_by(SpanDB.created_at)
+)
+_SELECT_CONTENT_HASHES_BY_RUN = (
+    select(SpanDB.content_hash).where(SpanDB.run_id == bindparam("run_id")).distinct()
+)
+
+# Columns selected by the raw (dict) read path, mirroring SpanDom fields plus
+# content_hash (equal hashes mean identical attrs)
+_SPAN_ROW_COLUMNS = (
+    SpanDB.id,
+    SpanDB.run_id,
+    SpanDB.node_id,
+    SpanDB.checkpoint_id,
+    SpanDB.kind,
+    SpanDB.name,
+    SpanDB.start_ts,
+    SpanDB.end_ts,
+    SpanDB.fingerprint,
+    SpanDB.content_hash,
+    SpanContentDB.attrs,
+)
+_SPAN_ROW_KEYS = tuple(c.key for c in _SPAN_ROW_COLUMNS)
+_SELECT_SPAN_ROWS_BY_RUN = (
+    select(*_SPAN_ROW_COLUMNS)
+    .outerjoin(SpanContentDB, SpanContentDB.content_hash == SpanDB.content_hash)
+    .where(SpanDB.run_id == bindparam("run_id"))
+    .order_by(SpanDB.created_at)
+)
+
+# Diff matching key; spans of two runs pair up when all four agree
+_MATCH_KEY = (SpanDB.kind, SpanDB.name, SpanDB.node_id, SpanDB.fingerprint)
+
+
+def _latest_per_key(run_param: str) -> Any:
+    """Span rows of one run, ranked so `rn == 1` is the last span per match key."""
+    return (
+        select(
+            *_SPAN_ROW_COLUMNS,
+            func.row_number()
+            .over(partition_by=_MATCH_KEY, order_by=SpanDB.created_at.desc())
+            .label("rn"),
+        )
+        .outerjoin(SpanContentDB, SpanContentDB.content_hash == SpanDB.content_hash)
+        .where(SpanDB.run_id == bindparam(run_param))
+        .subquery(run_param)
+    )
+
+
+def _same_key(a: Any, b: Any) -> Any:
+    return and_(
+        a.c.kind == b.c.kind,
+        a.c.name == b.c.name,
+        a.c.node_id.is_not_distinct_from(b.c.node_id),
+        a.c.fingerprint == b.c.fingerprint,
+    )
+
+
+def _key_order(side: Any) -> tuple[Any, ...]:
+    return (side.c.kind, side.c.name, side.c.node_id.nulls_first(), side.c.fingerprint)
+
+
+def _select_unmatched(side: Any, other: Any) -> Any:
+    # Anti-join: `side` spans whose key has no counterpart in `other`
+    return (
+        select(side.c.id, side.c.kind, side.c.name, side.c.node_id, side.c.fingerprint)
+        .outerjoin(other, and_(_same_key(side, other), other.c.rn == 1))
+        .where(side.c.rn == 1, other.c.id.is_(None))
+        .order_by(*_key_order(side))
+    )
+
+
+_LEFT = _latest_per_key("left")
+_RIGHT = _latest_per_key("right")
+_SELECT_MATCHED_PAIRS = (
+    select(
+        *(_LEFT.c[k] for k in _SPAN_ROW_KEYS), *(_RIGHT.c[k] for k in _SPAN_ROW_KEYS)
+    )
+    .join(_RIGHT, _same_key(_LEFT, _RIGHT))
+    .where(_LEFT.c.rn == 1, _RIGHT.c.rn == 1)
+    .order_by(*_key_order(_LEFT))
+)
+_SELECT_ONLY_LEFT = _select_unmatched(_LEFT, _RIGHT)
+_SELECT_ONLY_RIGHT = _select_unmatched(_RIGHT, _LEFT)
+
+
+def _content_hash(attrs: dict[str, Any]) -> str:
+    return xxhash.xxh3_128_hexdigest(
+        orjson.dumps(
+            attrs,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+            default=str,
+        )
+    )
+
+
+async def _insert_contents(
+    session: AsyncSession, contents: dict[str, dict[str, Any]]
+) -> None:
+    """Insert span contents, skipping hashes that are already stored."""
+    if session.get_bind().dialect.name == "postgresql":
+        # Touch existing rows instead of skipping them so they stay row-locked
+        # until commit; a concurrent delete_for_run then cannot remove content
+        # the spans being inserted are about to reference
+        stmt = pg_insert(SpanContentDB.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SpanContentDB.content_hash],
+            set_={"content_hash": stmt.excluded.content_hash},
+        )
+    else:
+        stmt = sqlite_insert(SpanContentDB.__table__).on_conflict_do_nothing()
+    if contents:
+        await session.exec(
+            stmt,
+            params=[{"content_hash": h, "attrs": a} for h, a in contents.items()],
+        )
+
+
 class UserRepository:
     @staticmethod
     def _dom_to_db(user: UserDom) -> UserDB:
@@ -32,44 +185,43 @@ class UserRepository:
         )
 
     @staticmethod
-    def create(user: UserDom) -> UserDom:
-        with Session(ENGINE) as session:
+    async def create(user: UserDom, *, session: AsyncSession | None = None) -> UserDom:
+        async with _session_scope(session) as session:
             session.add(UserRepository._dom_to_db(user))
-            session.commit()
             return user
 
     @staticmethod
-    def get(user_id: UUID_t) -> UserDom:
-        with Session(ENGINE) as session:
-            user_db = session.get(UserDB, user_id)
+    async def get(user_id: UUID_t, *, session: AsyncSession | None = None) -> UserDom:
+        async with _session_scope(session) as session:
+            user_db = await session.get(UserDB, user_id)
             return UserRepository._db_to_dom(user_db)
 
     @staticmethod
-    def get_or_none(user_id: UUID_t) -> UserDom | None:
-        with Session(ENGINE) as session:
-            user_db = session.get(UserDB, user_id)
+    async def get_or_none(
+        user_id: UUID_t, *, session: AsyncSession | None = None
+    ) -> UserDom | None:
+        async with _session_scope(session) as session:
+            user_db = await session.get(UserDB, user_id)
             return UserRepository._db_to_dom(user_db) if user_db else None
 
     @staticmethod
-    def list() -> list[UserDom]:
-        with Session(ENGINE) as session:
-            rows = session.exec(select(UserDB).order_by(UserDB.created_at.desc())).all()
+    async def list(*, session: AsyncSession | None = None) -> list[UserDom]:
+        async with _session_scope(session) as session:
+            rows = (await session.exec(_SELECT_USERS)).all()
             return [UserRepository._db_to_dom(r) for r in rows]
 
     @staticmethod
-    def update(user: UserDom) -> UserDom:
-        with Session(ENGINE) as session:
-            session.merge(UserRepository._dom_to_db(user))
-            session.commit()
+    async def update(user: UserDom, *, session: AsyncSession | None = None) -> UserDom:
+        async with _session_scope(session) as session:
+            await session.merge(UserRepository._dom_to_db(user))
             return user
 
     @staticmethod
-    def delete(user_id: UUID_t) -> None:
-        with Session(ENGINE) as session:
-            row = session.get(UserDB, user_id)
+    async def delete(user_id: UUID_t, *, session: AsyncSession | None = None) -> None:
+        async with _session_scope(session) as session:
+            row = await session.get(UserDB, user_id)
             if row is not None:
-                session.delete(row)
-                session.commit()
+                await session.delete(row)
 
 
 class RunRepository:
@@ -96,44 +248,43 @@ class RunRepository:
         )
 
     @staticmethod
-    def create(run: RunDom) -> RunDom:
-        with Session(ENGINE) as session:
+    async def create(run: RunDom, *, session: AsyncSession | None = None) -> RunDom:
+        async with _session_scope(session) as session:
             session.add(RunRepository._dom_to_db(run))
-            session.commit()
             return run
 
     @staticmethod
-    def get(run_id: UUID_t) -> RunDom:
-        with Session(ENGINE) as session:
-            row = session.get(RunDB, run_id)
+    async def get(run_id: UUID_t, *, session: AsyncSession | None = None) -> RunDom:
+        async with _session_scope(session) as session:
+            row = await session.get(RunDB, run_id)
             return RunRepository._db_to_dom(row)
 
     @staticmethod
-    def get_or_none(run_id: UUID_t) -> RunDom | None:
-        with Session(ENGINE) as session:
-            row = session.get(RunDB, run_id)
+    async def get_or_none(
+        run_id: UUID_t, *, session: AsyncSession | None = None
+    ) -> RunDom | None:
+        async with _session_scope(session) as session:
+            row = await session.get(RunDB, run_id)
             return RunRepository._db_to_dom(row) if row else None
 
     @staticmethod
-    def list() -> list[RunDom]:
-        with Session(ENGINE) as session:
-            rows = session.exec(select(RunDB).order_by(RunDB.created_at.desc())).all()
+    async def list(*, session: AsyncSession | None = None) -> list[RunDom]:
+        async with _session_scope(session) as session:
+            rows = (await session.exec(_SELECT_RUNS)).all()
             return [RunRepository._db_to_dom(r) for r in rows]
 
     @staticmethod
-    def update(run: RunDom) -> RunDom:
-        with Session(ENGINE) as session:
-            session.merge(RunRepository._dom_to_db(run))
-            session.commit()
+    async def update(run: RunDom, *, session: AsyncSession | None = None) -> RunDom:
+        async with _session_scope(session) as session:
+            await session.merge(RunRepository._dom_to_db(run))
             return run
 
     @staticmethod
-    def delete(run_id: UUID_t) -> None:
-        with Session(ENGINE) as session:
-            row = session.get(RunDB, run_id)
+    async def delete(run_id: UUID_t, *, session: AsyncSession | None = None) -> None:
+        async with _session_scope(session) as session:
+            row = await session.get(RunDB, run_id)
             if row is not None:
-                session.delete(row)
-                session.commit()
+                await session.delete(row)
 
 
 class SpanRepository:
@@ -149,11 +300,11 @@ class SpanRepository:
             start_ts=span.start_ts,
             end_ts=span.end_ts,
             fingerprint=span.fingerprint,
-            attrs=span.attrs,
+            content_hash=_content_hash(span.attrs or {}),
         )
 
     @staticmethod
-    def _db_to_dom(span_db: SpanDB) -> SpanDom:
+    def _db_to_dom(span_db: SpanDB, attrs: dict[str, Any] | None) -> SpanDom:
         return SpanDom(
             id=str(span_db.id),
             run_id=str(span_db.run_id),
@@ -164,31 +315,151 @@ class SpanRepository:
             start_ts=span_db.start_ts,
             end_ts=span_db.end_ts,
             fingerprint=span_db.fingerprint,
-            attrs=span_db.attrs,
+            # None when the span's content row is missing (outer join)
+            attrs=attrs or {},
         )
 
     @staticmethod
-    def create(span: SpanDom) -> SpanDom:
-        with Session(ENGINE) as session:
-            session.add(SpanRepository._dom_to_db(span))
-            session.commit()
+    async def create(span: SpanDom, *, session: AsyncSession | None = None) -> SpanDom:
+        async with _session_scope(session) as session:
+            row = SpanRepository._dom_to_db(span)
+            await _insert_contents(session, {row.content_hash: span.attrs or {}})
+            session.add(row)
             return span
 
     @staticmethod
-    def list_for_run(run_id: UUID_t) -> list[SpanDom]:
-        with Session(ENGINE) as session:
-            rows = session.exec(
-                select(SpanDB)
-                .where(SpanDB.run_id == run_id)
-                .order_by(SpanDB.created_at)
+    async def bulk_create(
+        spans: list[SpanDom],
+        *,
+        run: RunDom | None = None,
+        session: AsyncSession | None = None,
+    ) -> list[SpanDom]:
+        """Insert many spans (and optionally update their run) in one transaction.
+
+        Uses a single Core executemany INSERT rather than the ORM unit of work,
+        so no SpanDB instances are built or tracked. Attrs are stored once per
+        distinct content hash; already-stored contents are skipped.
+        """
+        if not spans and run is None:
+            return spans
+        base = datetime.now(timezone.utc)
+        hashes = [_content_hash(s.attrs or {}) for s in spans]
+        contents = {h: s.attrs or {} for h, s in zip(hashes, spans)}
+        # Offset by row index so created_at preserves insertion order within the batch
+        rows = [
+            {
+                "id": UUID(s.id),
+                "created_at": base + timedelta(microseconds=i),
+                "run_id": UUID(s.run_id),
+                "node_id": s.node_id,
+                "checkpoint_id": s.checkpoint_id,
+                "kind": s.kind,
+                "name": s.name,
+                "start_ts": s.start_ts,
+                "end_ts": s.end_ts,
+                "fingerprint": s.fingerprint,
+                "content_hash": h,
+            }
+            for i, (s, h) in enumerate(zip(spans, hashes))
+        ]
+        async with _session_scope(session) as session:
+            if rows:
+                await _insert_contents(session, contents)
+                await session.exec(insert(SpanDB.__table__), params=rows)
+            if run is not None:
+                await session.merge(RunRepository._dom_to_db(run))
+            return spans
+
+    @staticmethod
+    async def list_for_run(
+        run_id: UUID_t, *, session: AsyncSession | None = None
+    ) -> list[SpanDom]:
+        async with _session_scope(session) as session:
+            rows = (
+                await session.exec(_SELECT_SPANS_BY_RUN, params={"run_id": run_id})
+            ).all()
+            return [SpanRepository._db_to_dom(r, attrs) for r, attrs in rows]
+
+    @staticmethod
+    async def list_for_run_raw(
+        run_id: UUID_t, *, session: AsyncSession | None = None
+    ) -> list[dict[str, Any]]:
+        """Read-only variant of `list_for_run` returning plain row dicts.
+
+        Skips building SpanDB/SpanDom objects per row; keys match
+        `SpanDom.to_dict()` plus `content_hash`, so results can be serialized
+        directly.
+        """
+        async with _session_scope(session) as session:
+            rows = (
+                await session.exec(_SELECT_SPAN_ROWS_BY_RUN, params={"run_id": run_id})
+            ).all()
+            return [dict(r._mapping) for r in rows]
+
+    @staticmethod
+    async def diff_pairs(
+        left_id: UUID_t, right_id: UUID_t, *, session: AsyncSession | None = None
+    ) -> list[tuple[dict[str, Any], dict[str, Any]]]:
+        """Spans of two runs paired by (kind, name, node_id, fingerprint).
+
+        Matching is a single join in the database. When a key repeats within a
+        run, its last span (by created_at) is the one paired. Rows are plain
+        dicts shaped like `list_for_run_raw`, ordered by key.
+        """
+        n = len(_SPAN_ROW_KEYS)
+        async with _session_scope(session) as session:
+            rows = (
+                await session.exec(
+                    _SELECT_MATCHED_PAIRS,
+                    params={"left": left_id, "right": right_id},
+                )
             ).all()
-            return [SpanRepository._db_to_dom(r) for r in rows]
+            return [
+                (dict(zip(_SPAN_ROW_KEYS, r[:n])), dict(zip(_SPAN_ROW_KEYS, r[n:])))
+                for r in rows
+            ]
 
     @staticmethod
-    def delete_for_run(run_id: UUID_t) -> None:
-        with Session(ENGINE) as session:
-            # Efficient bulk delete by primary key filter
-            rows = session.exec(select(SpanDB).where(SpanDB.run_id == run_id)).all()
-            for row in rows:
-                session.delete(row)
-            session.commit()
+    async def diff_unmatched(
+        left_id: UUID_t, right_id: UUID_t, *, session: AsyncSession | None = None
+    ) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+        """Spans with no counterpart in the other run, as (only_left, only_right).
+
+        Only identifying columns (id and the match key) are read; attrs are not.
+        """
+        params = {"left": left_id, "right": right_id}
+        async with _session_scope(session) as session:
+            only_left = (await session.exec(_SELECT_ONLY_LEFT, params=params)).all()
+            only_right = (await session.exec(_SELECT_ONLY_RIGHT, params=params)).all()
+            return (
+                [dict(r._mapping) for r in only_left],
+                [dict(r._mapping) for r in only_right],
+            )
+
+    @staticmethod
+    async def delete_for_run(
+        run_id: UUID_t, *, session: AsyncSession | None = None
+    ) -> None:
+        async with _session_scope(session) as session:
+            hashes = (
+                await session.exec(
+                    _SELECT_CONTENT_HASHES_BY_RUN, params={"run_id": run_id}
+                )
+            ).all()
+            await session.exec(delete(SpanDB).where(SpanDB.run_id == run_id))
+            # Drop this run's contents unless another run's spans still share them.
+            # Best effort: if a concurrent bulk_create has just referenced one of
+            # them, the foreign key rejects the delete and the content is kept
+            if hashes:
+                try:
+                    async with session.begin_nested():
+                        await session.exec(
+                            delete(SpanContentDB).where(
+                                SpanContentDB.content_hash.in_(hashes),
+                                ~exists().where(
+                                    SpanDB.content_hash == SpanContentDB.content_hash
+                                ),
+                            )
+                        )
+                except IntegrityError:
+                    pass
@@ -0,0 +1,198 @@
+"""One-off upgrade for databases created by an older schema.
+
+`ensure_tables` only runs `create_all`, which creates missing tables but never
+alters existing ones. Databases created before span attrs moved into the
+content-addressed `spancontent` table need this upgrade once:
+
+    cd backend && python -m database.upgrade
+
+It runs in a single transaction, and every step checks the current schema
+first, so running it again is a no-op.
+
+It also recomputes span fingerprints recorded by the original SHA-256 scheme.
+Fingerprints are part of the diff match key, so spans recorded before and
+after the switch to XXH3-128 would otherwise never pair up.
+"""
+
+import asyncio
+import json
+from typing import Any
+
+from sqlalchemy import (
+    JSON,
+    Connection,
+    bindparam,
+    column,
+    func,
+    inspect,
+    select,
+    table,
+    text,
+    update,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.schema import AddConstraint
+from sqlmodel import SQLModel
+
+from database.engine import ENGINE
+from database.models import Span as SpanDB
+from database.models import SpanContent as SpanContentDB
+from database.repositories import _content_hash
+from services.observe import _static_fingerprint, compute_fingerprint
+
+_BATCH_SIZE = 1000
+
+# Hex length of current (XXH3-128) fingerprints; legacy SHA-256 ones are 64
+_FINGERPRINT_HEX_LEN = 32
+
+# The pre-upgrade span columns; SpanDB no longer maps attrs
+_LEGACY_SPAN = table(
+    "span", column("id"), column("attrs", JSON), column("content_hash")
+)
+
+
+def _columns(conn: Connection, table_name: str) -> dict[str, Any]:
+    return {c["name"]: c["type"] for c in inspect(conn).get_columns(table_name)}
+
+
+def _json_to_jsonb(conn: Connection) -> None:
+    # Postgres only: binary JSONB needs no re-parse on read and is GIN-indexable
+    quote = conn.dialect.identifier_preparer.quote
+    for table_name in ("user", "run"):
+        if not isinstance(_columns(conn, table_name)["meta_data"], JSONB):
+            conn.execute(
+                text(
+                    f"ALTER TABLE {quote(table_name)} ALTER COLUMN meta_data"
+                    " TYPE JSONB USING meta_data::jsonb"
+                )
+            )
+
+
+def _move_span_attrs(conn: Connection) -> None:
+    """Store each span's inline attrs in spancontent and drop span.attrs."""
+    columns = _columns(conn, "span")
+    if "attrs" not in columns:
+        return
+    if "content_hash" not in columns:
+        conn.execute(text("ALTER TABLE span ADD COLUMN content_hash VARCHAR"))
+
+    postgres = conn.dialect.name == "postgresql"
+    insert = pg_insert if postgres else sqlite_insert
+    insert_contents = insert(SpanContentDB.__table__).on_conflict_do_nothing()
+    set_content_hash = (
+        update(_LEGACY_SPAN)
+        .where(_LEGACY_SPAN.c.id == bindparam("span_id"))
+        .values(content_hash=bindparam("hash"))
+    )
+    select_batch = (
+        select(_LEGACY_SPAN.c.id, _LEGACY_SPAN.c.attrs)
+        .where(_LEGACY_SPAN.c.content_hash.is_(None))
+        .limit(_BATCH_SIZE)
+    )
+    while rows := conn.execute(select_batch).all():
+        contents: dict[str, dict[str, Any]] = {}
+        params = []
+        for span_id, attrs in rows:
+            content_hash = _content_hash(attrs or {})
+            contents[content_hash] = attrs or {}
+            params.append({"span_id": span_id, "hash": content_hash})
+        conn.execute(
+            insert_contents,
+            [{"content_hash": h, "attrs": a} for h, a in contents.items()],
+        )
+        conn.execute(set_content_hash, params)
+
+    if postgres:
+        conn.execute(text("ALTER TABLE span ALTER COLUMN content_hash SET NOT NULL"))
+    # Also drops the old GIN index on span.attrs, if there is one
+    conn.execute(text("ALTER TABLE span DROP COLUMN attrs"))
+
+
+def _add_content_foreign_key(conn: Connection) -> None:
+    # Postgres only: SQLite cannot add constraints to an existing table (and
+    # does not enforce foreign keys by default)
+    if any(
+        fk["referred_table"] == SpanContentDB.__tablename__
+        for fk in inspect(conn).get_foreign_keys("span")
+    ):
+        return
+    for constraint in SpanDB.__table__.foreign_key_constraints:
+        conn.execute(AddConstraint(constraint))
+
+
+def _current_fingerprint(
+    kind: str, name: str, attrs: dict[str, Any] | None
+) -> str | None:
+    """A legacy span's fingerprint under the current scheme, from its attrs."""
+    attrs = attrs or {}
+    if kind in ("node", "route"):
+        qualname = attrs.get("function")
+        return _static_fingerprint(kind, name, qualname) if qualname else None
+    # Tool spans recorded their args/kwargs as the JSON the old fingerprint
+    # hashed; parsed back, they re-encode to what the tool would hash now
+    request = attrs.get("request")
+    try:
+        args = json.loads(request["args"])
+        kwargs = json.loads(request["kwargs"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not isinstance(args, list) or not isinstance(kwargs, dict):
+        return None
+    return compute_fingerprint(kind, name, args=tuple(args), kwargs=kwargs)
+
+
+def _recompute_fingerprints(conn: Connection) -> None:
+    """Rewrite legacy SHA-256 span fingerprints in the current format."""
+    select_legacy = (
+        select(SpanDB.id, SpanDB.kind, SpanDB.name, SpanContentDB.attrs)
+        .outerjoin(SpanContentDB, SpanContentDB.content_hash == SpanDB.content_hash)
+        .where(func.length(SpanDB.fingerprint) != _FINGERPRINT_HEX_LEN)
+        .order_by(SpanDB.id)
+        .limit(_BATCH_SIZE)
+    )
+    set_fingerprint = (
+        update(SpanDB.__table__)
+        .where(SpanDB.__table__.c.id == bindparam("span_id"))
+        .values(fingerprint=bindparam("fp"))
+    )
+    # Paged by id: spans that cannot be recomputed keep their legacy
+    # fingerprint and would otherwise be selected again
+    after = None
+    while rows := conn.execute(
+        select_legacy if after is None else select_legacy.where(SpanDB.id > after)
+    ).all():
+        params = []
+        for span_id, kind, name, attrs in rows:
+            fingerprint = _current_fingerprint(kind, name, attrs)
+            if fingerprint is not None:
+                params.append({"span_id": span_id, "fp": fingerprint})
+        if params:
+            conn.execute(set_fingerprint, params)
+        after = rows[-1][0]
+
+
+def _upgrade(conn: Connection) -> None:
+    # New tables (spancontent, with its indexes) first
+    SQLModel.metadata.create_all(conn)
+    postgres = conn.dialect.name == "postgresql"
+    if postgres:
+        _json_to_jsonb(conn)
+    _move_span_attrs(conn)
+    if postgres:
+        _add_content_foreign_key(conn)
+    # Indexes added to the existing span table since it was created
+    for index in SpanDB.__table__.indexes:
+        index.create(conn, checkfirst=True)
+    _recompute_fingerprints(conn)
+
+
+async def main() -> None:
+    async with ENGINE.begin() as conn:
+        await conn.run_sync(_upgrade)
+    await ENGINE.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
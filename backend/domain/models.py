@@ -21,6 +21,17 @@ class Run:
     policy: str | None
     meta_data: dict[str, Any]
 
+    def to_dict(self) -> dict[str, Any]:
+        """Shallow dict view for JSON responses (unlike asdict, no deep copy)."""
+        return {
+            "id": self.id,
+            "thread_id": self.thread_id,
+            "status": self.status,
+            "graph_signature": self.graph_signature,
+            "policy": self.policy,
+            "meta_data": self.meta_data,
+        }
+
 
 @dataclass
 class Span:
@@ -34,3 +45,18 @@ class Span:
     end_ts: float | None
     fingerprint: str
     attrs: dict[str, Any]
+
+    def to_dict(self) -> dict[str, Any]:
+        """Shallow dict view for JSON responses (unlike asdict, no deep copy)."""
+        return {
+            "id": self.id,
+            "run_id": self.run_id,
+            "node_id": self.node_id,
+            "checkpoint_id": self.checkpoint_id,
+            "kind": self.kind,
+            "name": self.name,
+            "start_ts": self.start_ts,
+            "end_ts": self.end_ts,
+            "fingerprint": self.fingerprint,
+            "attrs": self.attrs,
+        }
@@ -2,19 +2,20 @@
 from contextlib import asynccontextmanager
 
 from api import router as api_router
-from database.engine import ensure_tables
+from database.engine import ENGINE, ensure_tables
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    ensure_tables()
+    await ensure_tables()
     yield
+    await ENGINE.dispose()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://127.0.0.1:3000"],
@@ -25,13 +26,13 @@ app.add_middleware(
 
 
 @app.get("/")
-def root():
-    return JSONResponse({"ok": True, "message": "API root"})
+async def root():
+    return ORJSONResponse({"ok": True, "message": "API root"})
 
 
 @app.get("/healthz")
-def health():
-    return JSONResponse({"ok": True, "message": "API is healthy"})
+async def health():
+    return ORJSONResponse({"ok": True, "message": "API is healthy"})
 
 
 app.include_router(api_router, prefix="/api")
@@ -14,17 +14,39 @@ simple in-memory facilities you can replace later with durable stores.
 
 from __future__ import annotations
 
+import bisect
 import contextlib
+import contextvars
 import dataclasses
 import functools
-import hashlib
 import json
+import os
+import queue
+import sys
 import threading
 import time
 import types
-import uuid
 from typing import Any, Callable, Iterator
 
+import blake3
+import xxhash
+
+try:
+    import orjson
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(
+            obj,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+            default=str,
+        )
+
+except ImportError:  # pragma: no cover - stdlib fallback when orjson is absent
+
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, sort_keys=True, default=str).encode("utf-8")
+
+
 # --------------------
 # Span & Artifact model
 # --------------------
@@ -48,57 +70,136 @@ class Span:
     node_id: str | None
     kind: str  # e.g., "http", "db", "tool"
     name: str
-    start: float
-    end: float | None
+    start: int  # time.monotonic_ns(); see to_unix_seconds
+    end: int | None
     attrs: dict[str, Any]
     fingerprint: str
     request_artifact: Artifact | None = None
     response_artifact: Artifact | None = None
 
+    def serialize_attrs(self) -> dict[str, Any]:
+        """Attrs ready to persist: the raw tool response is JSON-encoded here."""
+        if "response" not in self.attrs:
+            return self.attrs
+        attrs = dict(self.attrs)
+        attrs["response"] = _safe_json(attrs["response"]).decode()
+        return attrs
+
 
 # --------------------
-# Thread-local context
+# Span context
 # --------------------
 
 
-_local = threading.local()
+@dataclasses.dataclass(slots=True, frozen=True)
+class _Ctx:
+    run_id: str | None = None
+    node_id: str | None = None
+    checkpoint_id: str | None = None
+    policy: str = "strict"
+    # Spans recorded within the scope, queued for export as one batch on exit
+    pending: list[tuple[Any, ...]] | None = dataclasses.field(
+        default=None, compare=False, repr=False
+    )
 
 
-def _get_ctx() -> dict[str, Any]:
-    ctx = getattr(_local, "ctx", None)
-    if ctx is None:
-        ctx = {
-            "run_id": None,
-            "node_id": None,
-            "checkpoint_id": None,
-            "policy": "strict",
-        }
-        _local.ctx = ctx
-    return ctx
+# A ContextVar (not threading.local) so the context follows LangGraph when it
+# runs fan-out branches on executor threads; each copied context sees the
+# caller's run/node tags. _Ctx is frozen since copied contexts share the same
+# object; scopes bind a replacement instead.
+_ctx_var: contextvars.ContextVar[_Ctx] = contextvars.ContextVar(
+    "observe_ctx", default=_Ctx()
+)
 
 
-@contextlib.contextmanager
-def span_context(
-    *,
-    run_id: str | None,
-    node_id: str | None,
-    checkpoint_id: str | None,
-    policy: str | None = None,
-) -> Iterator[None]:
-    ctx = _get_ctx()
-    prev = ctx.copy()
-    try:
-        if run_id is not None:
-            ctx["run_id"] = run_id
-        if node_id is not None:
-            ctx["node_id"] = node_id
-        if checkpoint_id is not None:
-            ctx["checkpoint_id"] = checkpoint_id
-        if policy is not None:
-            ctx["policy"] = policy
-        yield
-    finally:
-        _local.ctx = prev
+def _get_ctx() -> _Ctx:
+    return _ctx_var.get()
+
+
+class span_context:
+    """Scope run/node/checkpoint/policy tags; None leaves a tag unchanged.
+
+    A plain class rather than @contextlib.contextmanager: entering and exiting
+    skips the generator frame and helper object, and it runs on every
+    instrumented node call.
+    """
+
+    __slots__ = (
+        "_run_id",
+        "_node_id",
+        "_checkpoint_id",
+        "_policy",
+        "_pending",
+        "_token",
+    )
+
+    def __init__(
+        self,
+        *,
+        run_id: str | None,
+        node_id: str | None,
+        checkpoint_id: str | None,
+        policy: str | None = None,
+    ) -> None:
+        self._run_id = run_id
+        self._node_id = node_id
+        self._checkpoint_id = checkpoint_id
+        self._policy = policy
+
+    def __enter__(self) -> None:
+        ctx = _ctx_var.get()
+        self._pending: list[tuple[Any, ...]] = []
+        self._token = _ctx_var.set(
+            _Ctx(
+                run_id=ctx.run_id if self._run_id is None else self._run_id,
+                node_id=ctx.node_id if self._node_id is None else self._node_id,
+                checkpoint_id=(
+                    ctx.checkpoint_id
+                    if self._checkpoint_id is None
+                    else self._checkpoint_id
+                ),
+                policy=ctx.policy if self._policy is None else self._policy,
+                pending=self._pending,
+            )
+        )
+
+    def __exit__(self, *exc_info: object) -> None:
+        _ctx_var.reset(self._token)
+        # Fan-out threads inherit this scope and append to the same batch; they
+        # have all finished by the time the scope that started them exits
+        if self._pending:
+            _SPAN_QUEUE.put_nowait(self._pending)
+
+
+# --------------------
+# Recording switch
+# --------------------
+
+# When off, instrumented functions run undecorated: no serialization, hashing,
+# stub lookup or span allocation. Set OBSERVABILITY_ENABLED=0 to start disabled.
+_OFF_VALUES = ("0", "false", "no", "off")
+OBSERVABILITY_ENABLED = (
+    os.environ.get("OBSERVABILITY_ENABLED", "1").lower() not in _OFF_VALUES
+)
+
+
+def enable() -> None:
+    global OBSERVABILITY_ENABLED
+    OBSERVABILITY_ENABLED = True
+
+
+def disable() -> None:
+    global OBSERVABILITY_ENABLED
+    OBSERVABILITY_ENABLED = False
+
+
+def _in_run() -> bool:
+    return _ctx_var.get().run_id is not None
+
+
+def _recording() -> bool:
+    # Calls made outside any run's span_context are not recorded either
+    return OBSERVABILITY_ENABLED and _in_run()
 
 
 # --------------------
@@ -107,50 +208,123 @@ def span_context(
 
 
 class _StubRegistry:
+    """Fingerprint -> stubbed response map, read far more often than written.
+
+    Copy-on-write: writers (serialized by the lock) build a new dict and rebind
+    it; readers take no lock and see either the old or the new dict whole.
+    """
+
     def __init__(self) -> None:
         self._lock = threading.Lock()
         self._fingerprint_to_response: dict[str, Any] = {}
 
     def add_stub(self, fingerprint: str, response: Any) -> None:
         with self._lock:
-            self._fingerprint_to_response[fingerprint] = response
+            new = dict(self._fingerprint_to_response)
+            new[fingerprint] = response
+            self._fingerprint_to_response = new
 
     def get(self, fingerprint: str) -> tuple[bool, Any | None]:
-        with self._lock:
-            if fingerprint in self._fingerprint_to_response:
-                return True, self._fingerprint_to_response[fingerprint]
-            return False, None
+        d = self._fingerprint_to_response
+        if fingerprint in d:
+            return True, d[fingerprint]
+        return False, None
 
 
 STUBS = _StubRegistry()
-RECORDED_SPANS: list[Span] = []
+
+# Exported spans awaiting drain, keyed by run_id. Only the exporter thread
+# appends; drains pop a run's list. Unbounded: spans are never dropped, and
+# each run's list is released when that run is drained.
+_recorded_lock = threading.Lock()
+_recorded: dict[str | None, list[Span]] = {}
+
+
+def drain_recorded_spans(run_id: str | None) -> list[Span]:
+    """Remove and return the recorded spans tagged with `run_id`.
+
+    Spans of other runs are kept for their own drain. Results are ordered by
+    span end time, i.e. by when each span was recorded. Blocks until batches
+    still queued for export have been exported; a span is only queued once
+    the span_context it was recorded in has exited.
+    """
+
+    _flush_spans()
+    with _recorded_lock:
+        spans = _recorded.pop(run_id, [])
+    spans.sort(key=lambda s: s.start if s.end is None else s.end)
+    return spans
+
+
+# Span clocks are monotonic (immune to wall-clock jumps, no float boxing);
+# this offset maps them back onto the Unix epoch for storage/display
+_MONOTONIC_TO_UNIX_NS = time.time_ns() - time.monotonic_ns()
 
 
-def _now() -> float:
-    return time.time()
+def _now() -> int:
+    return time.monotonic_ns()
 
 
-def _safe_json(obj: Any) -> str:
+def to_unix_seconds(monotonic_ns: int) -> float:
+    """Convert a span timestamp (`Span.start`/`Span.end`) to Unix seconds."""
+    return (monotonic_ns + _MONOTONIC_TO_UNIX_NS) / 1e9
+
+
+def _safe_str(obj: Any) -> str:
+    # str()/repr() recurse too, so overly deep values can fail here as well
     try:
-        return json.dumps(obj, sort_keys=True, default=str)
+        return str(obj)
     except Exception:
-        return json.dumps(str(obj))
+        return f"<unrepresentable {type(obj).__name__}>"
+
+
+def _safe_json(obj: Any) -> bytes:
+    try:
+        return _dumps(obj)
+    except Exception:
+        return _dumps(_safe_str(obj))
+
+
+# Graph signatures: content addressing, not security checks; BLAKE3 is
+# SIMD-parallel and several times faster than SHA-256.
+_HASHER = blake3.blake3
+
+
+# Span fingerprints (tool, node and route alike) only key dict lookups (stubs,
+# diff matching), so they use XXH3-128: on the small payloads typical here it
+# outruns BLAKE3, whose SIMD lanes only pay off on larger inputs. One hasher
+# keeps a single digest format in the span.fingerprint match key.
+_FINGERPRINT_HASHER = xxhash.xxh3_128
+
 
+def _static_fingerprint(kind: str, name: str, qualname: str) -> str:
+    # Node and route fingerprints are constant per decorated function
+    return _FINGERPRINT_HASHER(f"{kind}:{name}:{qualname}".encode()).hexdigest()
 
-def _hash_str(s: str) -> str:
-    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+
+def _fingerprint_prefix(kind: str, name: str) -> bytes:
+    return _dumps({"kind": kind, "name": name})
+
+
+def _fingerprint_with_prefix(
+    prefix: bytes, args: tuple[Any, ...], kwargs: dict[str, Any]
+) -> str:
+    # Streams three self-delimiting JSON values into one hasher; decorators
+    # pass a prefix serialized once at decoration time
+    try:
+        args_json, kwargs_json = _dumps(args), _dumps(kwargs)
+    except Exception:
+        args_json, kwargs_json = _safe_str(args).encode(), _safe_str(kwargs).encode()
+    hasher = _FINGERPRINT_HASHER(prefix)
+    hasher.update(args_json)
+    hasher.update(kwargs_json)
+    return hasher.hexdigest()
 
 
 def compute_fingerprint(
     kind: str, name: str, *, args: tuple[Any, ...], kwargs: dict[str, Any]
 ) -> str:
-    payload = {
-        "kind": kind,
-        "name": name,
-        "args": _safe_json(args),
-        "kwargs": _safe_json(kwargs),
-    }
-    return _hash_str(json.dumps(payload, sort_keys=True))
+    return _fingerprint_with_prefix(_fingerprint_prefix(kind, name), args, kwargs)
 
 
 # --------------------
@@ -158,10 +332,8 @@ def compute_fingerprint(
 # --------------------
 
 
-def _make_request_payload(
-    args: tuple[Any, ...], kwargs: dict[str, Any]
-) -> dict[str, Any]:
-    return {"args": _safe_json(args), "kwargs": _safe_json(kwargs)}
+def _make_request_payload(args: Any, kwargs: Any) -> dict[str, Any]:
+    return {"args": _safe_json(args).decode(), "kwargs": _safe_json(kwargs).decode()}
 
 
 def _tool_attrs(
@@ -169,7 +341,8 @@ def _tool_attrs(
     function_qualname: str,
     mode: str,
     status: str,
-    request_payload: dict[str, Any],
+    args: Any,
+    kwargs: Any,
     response: Any | None = None,
     error: BaseException | None = None,
 ) -> dict[str, Any]:
@@ -177,20 +350,44 @@ def _tool_attrs(
         "function": function_qualname,
         "mode": mode,
         "status": status,
-        "request": request_payload,
+        "request": _make_request_payload(args, kwargs),
     }
     if error is not None:
         attrs["error"] = repr(error)
     if response is not None:
-        attrs["response"] = _safe_json(response)
+        # Snapshotted, not encoded; encoded by Span.serialize_attrs on export
+        attrs["response"] = response
     return attrs
 
 
+def _json_safe_copy(value: Any) -> Any:
+    """Copy containers into JSON-shaped ones; scalars are shared, not copied."""
+    if isinstance(value, dict):
+        return {
+            k if isinstance(k, str) else str(k): _json_safe_copy(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [_json_safe_copy(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def _snapshot(value: Any) -> Any:
+    # Instrumentation must never break the wrapped call: self-referencing or
+    # overly deep values are recorded as their str() instead
+    try:
+        return _json_safe_copy(value)
+    except Exception:
+        return _safe_str(value)
+
+
 def _snapshot_state_dict(value: Any) -> Any | None:
     if not isinstance(value, dict):
         return None
     try:
-        return json.loads(_safe_json(value))
+        return _json_safe_copy(value)
     except Exception:
         return value
 
@@ -229,36 +426,98 @@ def _route_attrs(
         "before_state": before_state,
     }
     if choice is not None:
-        attrs["choice"] = _safe_json(choice)
+        attrs["choice"] = _safe_json(choice).decode()
     if error is not None:
         attrs["error"] = repr(error)
     return attrs
 
 
+# --------------------
+# Span export
+# --------------------
+
+# Wrappers only collect the pieces of a span (values already snapshotted on the
+# call path, plus a deferred attrs builder) into the enclosing span_context's
+# batch, which is queued whole when the scope exits; the exporter thread does
+# the encoding and Span construction off the instrumented call path. A threading.Event on the queue
+# is a flush marker, set once everything queued before it has been exported.
+_SPAN_QUEUE: queue.SimpleQueue[list[tuple[Any, ...]] | threading.Event] = (
+    queue.SimpleQueue()
+)
+
+
+def _new_span_id() -> str:
+    # Random (version 4, RFC 4122 variant) UUID as 32 hex chars, without the
+    # uuid.UUID object and its str() formatting; ~4x faster than str(uuid4())
+    b = bytearray(os.urandom(16))
+    b[6] = (b[6] & 0x0F) | 0x40
+    b[8] = (b[8] & 0x3F) | 0x80
+    return b.hex()
+
+
+def _export_loop() -> None:
+    while True:
+        item = _SPAN_QUEUE.get()
+        if isinstance(item, threading.Event):
+            item.set()
+            continue
+        spans: list[Span] = []
+        for kind, name, start_ts, end_ts, build_attrs, fp, node_id, ctx in item:
+            try:
+                attrs = build_attrs()
+            except Exception as exc:
+                attrs = {"status": "error", "error": f"attrs export failed: {exc!r}"}
+            spans.append(
+                Span(
+                    id=_new_span_id(),
+                    run_id=ctx.run_id,
+                    checkpoint_id=ctx.checkpoint_id,
+                    node_id=node_id if node_id is not None else ctx.node_id,
+                    kind=kind,
+                    name=name,
+                    start=start_ts,
+                    end=end_ts,
+                    attrs=attrs,
+                    fingerprint=fp,
+                )
+            )
+        with _recorded_lock:
+            for span in spans:
+                _recorded.setdefault(span.run_id, []).append(span)
+
+
+def _flush_spans() -> None:
+    """Block until every span batch queued so far has been exported."""
+    done = threading.Event()
+    _SPAN_QUEUE.put(done)
+    done.wait()
+
+
+threading.Thread(target=_export_loop, name="observe-exporter", daemon=True).start()
+
+
 def _record_span(
     *,
     kind: str,
     name: str,
-    start_ts: float,
-    end_ts: float,
-    attrs: dict[str, Any],
+    start_ts: int,
+    end_ts: int,
+    attrs: Callable[[], dict[str, Any]],
     fingerprint: str,
     node_override: str | None = None,
 ) -> None:
+    # Only reached while _recording(), so the context always has a run_id (no
+    # empty-context span variant is needed) and a batch from the span_context
+    # that set it. _Ctx is immutable so capturing it needs no copy
     ctx = _get_ctx()
-    span = Span(
-        id=str(uuid.uuid4()),
-        run_id=ctx.get("run_id"),
-        checkpoint_id=ctx.get("checkpoint_id"),
-        node_id=node_override if node_override is not None else ctx.get("node_id"),
-        kind=kind,
-        name=name,
-        start=start_ts,
-        end=end_ts,
-        attrs=attrs,
-        fingerprint=fingerprint,
+    ctx.pending.append(
+        (kind, name, start_ts, end_ts, attrs, fingerprint, node_override, ctx)
     )
-    RECORDED_SPANS.append(span)
+
+
+# Exact types (not subclasses) whose equal values always share one encoding.
+# float is left out: 0.0 == -0.0 (and hash alike) but they encode differently
+_ATOMIC_TYPES = frozenset({str, int, bool, type(None)})
 
 
 def instrument_tool(
@@ -266,31 +525,74 @@ def instrument_tool(
 ) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
     """Decorator to record a span for a function and optionally stub responses.
 
+    When observability is disabled the function is called directly. Outside
+    any run's span_context stubs are still consulted, but no span is recorded.
+
     Usage:
         @instrument_tool("random")
         def _tool_random():
             ...
     """
 
+    # Stored on every span this decorator records; intern so they share one object
+    name = sys.intern(name)
+    kind = sys.intern(kind)
+
     def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
         qualname = getattr(func, "__qualname__", func.__name__)
+        prefix = _fingerprint_prefix(kind, name)
+
+        # Keyed on (type, value) per argument so equal-but-distinct values such
+        # as 1 / True, which serialize differently, never share an entry. Only
+        # calls whose arguments are all atomic scalars are cached: nested
+        # containers would compare equal across such values one level down.
+        @functools.lru_cache(maxsize=1024)
+        def _cached_fingerprint(
+            typed_args: tuple[tuple[type, Any], ...],
+            typed_kwargs: tuple[tuple[str, type, Any], ...],
+        ) -> str:
+            return _fingerprint_with_prefix(
+                prefix,
+                tuple(a for _, a in typed_args),
+                {k: v for k, _, v in typed_kwargs},
+            )
+
+        def _fingerprint(args: tuple[Any, ...], kwargs: dict[str, Any]) -> str:
+            if all(type(a) in _ATOMIC_TYPES for a in args) and all(
+                type(v) in _ATOMIC_TYPES for v in kwargs.values()
+            ):
+                return _cached_fingerprint(
+                    tuple((type(a), a) for a in args),
+                    tuple((k, type(v), v) for k, v in sorted(kwargs.items())),
+                )
+            # Containers or other objects: fingerprint them in full every call
+            return _fingerprint_with_prefix(prefix, args, kwargs)
 
         @functools.wraps(func)
         def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not OBSERVABILITY_ENABLED:
+                return func(*args, **kwargs)
             start_ts = _now()
-            fingerprint = compute_fingerprint(kind, name, args=args, kwargs=kwargs)
-            request_payload = _make_request_payload(args, kwargs)
-
+            fingerprint = _fingerprint(args, kwargs)
             is_stubbed, stubbed_value = STUBS.get(fingerprint)
+            if not _in_run():
+                return stubbed_value if is_stubbed else func(*args, **kwargs)
+            # Snapshot before the call (it may mutate its arguments); only the
+            # encoding is left to the exporter
+            request_args = _snapshot(args)
+            request_kwargs = _snapshot(kwargs)
+
             if is_stubbed:
                 result = stubbed_value
                 end_ts = _now()
-                attrs = _tool_attrs(
+                attrs = functools.partial(
+                    _tool_attrs,
                     function_qualname=qualname,
                     mode="stubbed",
                     status="ok",
-                    request_payload=request_payload,
-                    response=result,
+                    args=request_args,
+                    kwargs=request_kwargs,
+                    response=_snapshot(result),
                 )
                 _record_span(
                     kind=kind,
@@ -305,12 +607,14 @@ def instrument_tool(
             try:
                 result = func(*args, **kwargs)
                 end_ts = _now()
-                attrs = _tool_attrs(
+                attrs = functools.partial(
+                    _tool_attrs,
                     function_qualname=qualname,
                     mode="live",
                     status="ok",
-                    request_payload=request_payload,
-                    response=result,
+                    args=request_args,
+                    kwargs=request_kwargs,
+                    response=_snapshot(result),
                 )
                 _record_span(
                     kind=kind,
@@ -323,11 +627,13 @@ def instrument_tool(
                 return result
             except Exception as exc:
                 end_ts = _now()
-                attrs = _tool_attrs(
+                attrs = functools.partial(
+                    _tool_attrs,
                     function_qualname=qualname,
                     mode="live",
                     status="error",
-                    request_payload=request_payload,
+                    args=request_args,
+                    kwargs=request_kwargs,
                     error=exc,
                 )
                 _record_span(
@@ -350,25 +656,29 @@ def instrument_node(name: str) -> Callable[[Callable[..., Any]], Callable[..., A
 
     def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
         qualname = getattr(func, "__qualname__", func.__name__)
+        # Interned: every span of this node shares one fingerprint string
+        fingerprint = sys.intern(_static_fingerprint("node", name, qualname))
 
         @functools.wraps(func)
         def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _recording():
+                return func(*args, **kwargs)
             start_ts = _now()
             before_state = _snapshot_state_dict(args[0]) if args else None
             with span_context(
-                run_id=_get_ctx().get("run_id"),
+                run_id=_get_ctx().run_id,
                 node_id=name,
-                checkpoint_id=_get_ctx().get("checkpoint_id"),
+                checkpoint_id=_get_ctx().checkpoint_id,
             ):
                 try:
                     result = func(*args, **kwargs)
                     end_ts = _now()
-                    after_state = _snapshot_state_dict(result)
-                    attrs = _node_attrs(
+                    attrs = functools.partial(
+                        _node_attrs,
                         function_qualname=qualname,
                         status="ok",
                         before_state=before_state,
-                        after_state=after_state,
+                        after_state=_snapshot_state_dict(result),
                     )
                     _record_span(
                         kind="node",
@@ -376,13 +686,14 @@ def instrument_node(name: str) -> Callable[[Callable[..., Any]], Callable[..., A
                         start_ts=start_ts,
                         end_ts=end_ts,
                         attrs=attrs,
-                        fingerprint=_hash_str(f"node:{name}:{qualname}"),
+                        fingerprint=fingerprint,
                         node_override=name,
                     )
                     return result
                 except Exception as exc:
                     end_ts = _now()
-                    attrs = _node_attrs(
+                    attrs = functools.partial(
+                        _node_attrs,
                         function_qualname=qualname,
                         status="error",
                         before_state=before_state,
@@ -394,7 +705,7 @@ def instrument_node(name: str) -> Callable[[Callable[..., Any]], Callable[..., A
                         start_ts=start_ts,
                         end_ts=end_ts,
                         attrs=attrs,
-                        fingerprint=_hash_str(f"node:{name}:{qualname}"),
+                        fingerprint=fingerprint,
                         node_override=name,
                     )
                     raise
@@ -413,24 +724,28 @@ def instrument_router(name: str) -> Callable[[Callable[..., Any]], Callable[...,
 
     def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
         qualname = getattr(func, "__qualname__", func.__name__)
+        fingerprint = sys.intern(_static_fingerprint("route", name, qualname))
 
         @functools.wraps(func)
         def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _recording():
+                return func(*args, **kwargs)
             start_ts = _now()
             before_state = _snapshot_state_dict(args[0]) if args else None
             with span_context(
-                run_id=_get_ctx().get("run_id"),
+                run_id=_get_ctx().run_id,
                 node_id=name,
-                checkpoint_id=_get_ctx().get("checkpoint_id"),
+                checkpoint_id=_get_ctx().checkpoint_id,
             ):
                 try:
                     result = func(*args, **kwargs)
                     end_ts = _now()
-                    attrs = _route_attrs(
+                    attrs = functools.partial(
+                        _route_attrs,
                         function_qualname=qualname,
                         status="ok",
                         before_state=before_state,
-                        choice=result,
+                        choice=_snapshot(result),
                     )
                     _record_span(
                         kind="route",
@@ -438,13 +753,14 @@ def instrument_router(name: str) -> Callable[[Callable[..., Any]], Callable[...,
                         start_ts=start_ts,
                         end_ts=end_ts,
                         attrs=attrs,
-                        fingerprint=_hash_str(f"route:{name}:{qualname}"),
+                        fingerprint=fingerprint,
                         node_override=name,
                     )
                     return result
                 except Exception as exc:
                     end_ts = _now()
-                    attrs = _route_attrs(
+                    attrs = functools.partial(
+                        _route_attrs,
                         function_qualname=qualname,
                         status="error",
                         before_state=before_state,
@@ -456,7 +772,7 @@ def instrument_router(name: str) -> Callable[[Callable[..., Any]], Callable[...,
                         start_ts=start_ts,
                         end_ts=end_ts,
                         attrs=attrs,
-                        fingerprint=_hash_str(f"route:{name}:{qualname}"),
+                        fingerprint=fingerprint,
                         node_override=name,
                     )
                     raise
@@ -467,7 +783,7 @@ def instrument_router(name: str) -> Callable[[Callable[..., Any]], Callable[...,
 
 
 # --------------------
-# Graph recorder (monkey patches add_node/add_edge/add_conditional_edges)
+# Graph recorder (StateGraph subclass recording add_node/add_edge/conditionals)
 # --------------------
 
 
@@ -499,33 +815,56 @@ class RecordedGraph:
 
     @property
     def signature(self) -> str:
-        # Deterministic signature independent of object identity
-        payload = {
-            "entry": self.entrypoint,
-            "nodes": [
-                dataclasses.asdict(n) for n in sorted(self.nodes, key=lambda n: n.name)
-            ],
-            "edges": [
-                dataclasses.asdict(e)
-                for e in sorted(self.edges, key=lambda e: (e.source, e.target))
-            ],
-            "conds": [
-                dataclasses.asdict(c)
-                for c in sorted(
-                    self.conditionals, key=lambda c: (c.source, c.chooser_qualname)
-                )
-            ],
-        }
-        return _hash_str(json.dumps(payload, sort_keys=True))
+        # Deterministic signature independent of object identity. The recorder
+        # keeps each list sorted as it is built, so no sorting happens here.
+        # Fields stream straight into the hasher: \x00 ends a field, \x01 a
+        # record, \x02 a section, so distinct graphs never share a byte stream.
+        h = _HASHER()
+        h.update(b"\x03" if self.entrypoint is None else self.entrypoint.encode())
+        h.update(b"\x02")
+        for n in self.nodes:
+            h.update(f"{n.name}\x00{n.function_qualname}\x00\x01".encode())
+        h.update(b"\x02")
+        for e in self.edges:
+            h.update(f"{e.source}\x00{e.target}\x00\x01".encode())
+        h.update(b"\x02")
+        for c in self.conditionals:
+            h.update(f"{c.source}\x00{c.chooser_qualname}\x00".encode())
+            for key in sorted(c.mapping, key=str):
+                h.update(f"{key}\x00{c.mapping[key]}\x00".encode())
+            h.update(b"\x01")
+        return h.hexdigest()
+
+
+def _node_key(n: RecordedNode) -> str:
+    return n.name
+
+
+def _edge_key(e: RecordedEdge) -> tuple[str, str]:
+    return (e.source, e.target)
+
+
+def _cond_key(c: RecordedConditional) -> tuple[str, str]:
+    return (c.source, c.chooser_qualname)
 
 
 class _GraphRecorder:
     def __init__(self) -> None:
+        # Each list is kept in signature order via sorted insertion
         self.nodes: list[RecordedNode] = []
         self.edges: list[RecordedEdge] = []
         self.conds: list[RecordedConditional] = []
         self.entrypoint: str | None = None
 
+    def add_node(self, node: RecordedNode) -> None:
+        bisect.insort(self.nodes, node, key=_node_key)
+
+    def add_edge(self, edge: RecordedEdge) -> None:
+        bisect.insort(self.edges, edge, key=_edge_key)
+
+    def add_conditional(self, cond: RecordedConditional) -> None:
+        bisect.insort(self.conds, cond, key=_cond_key)
+
     def to_record(self) -> RecordedGraph:
         return RecordedGraph(
             self.entrypoint, list(self.nodes), list(self.edges), list(self.conds)
@@ -533,12 +872,16 @@ class _GraphRecorder:
 
 
 @contextlib.contextmanager
-def record_stategraph_build() -> Iterator[_GraphRecorder]:
-    """Record StateGraph topology by monkey-patching add_node/edge/conditional.
+def record_stategraph_build() -> Iterator[tuple[_GraphRecorder, type]]:
+    """Record StateGraph topology through a recording StateGraph subclass.
+
+    Yields the recorder and the subclass; graphs built from the subclass record
+    their nodes/edges/conditionals. StateGraph itself is never patched, so
+    concurrent builds (recording or not) do not interfere.
 
     Usage:
-        with record_stategraph_build() as rec:
-            graph = StateGraph(State)
+        with record_stategraph_build() as (rec, RecordingStateGraph):
+            graph = RecordingStateGraph(State)
             ... add nodes/edges ...
         signature = rec.to_record().signature
     """
@@ -550,53 +893,43 @@ def record_stategraph_build() -> Iterator[_GraphRecorder]:
 
     recorder = _GraphRecorder()
 
-    orig_add_node = StateGraph.add_node
-    orig_add_edge = StateGraph.add_edge
-    orig_add_conditional_edges = StateGraph.add_conditional_edges
-    orig_set_entry_point = StateGraph.set_entry_point
-
     def _qualname(fn: Any) -> str:
         if isinstance(fn, (types.FunctionType, types.MethodType)):
             return getattr(fn, "__qualname__", getattr(fn, "__name__", str(fn)))
         return str(fn)
 
-    def add_node(self: Any, name: str, fn: Callable[..., Any]) -> None:  # type: ignore[override]
-        recorder.nodes.append(RecordedNode(name=name, function_qualname=_qualname(fn)))
-        return orig_add_node(self, name, fn)
-
-    def add_edge(self: Any, source: str, target: str) -> None:  # type: ignore[override]
-        recorder.edges.append(RecordedEdge(source=source, target=str(target)))
-        return orig_add_edge(self, source, target)
-
-    def add_conditional_edges(self: Any, source: str, chooser: Callable[..., Any], mapping: dict[str, Any]) -> None:  # type: ignore[override]
-        normalized: dict[str, str] = {}
-        for key, tgt in mapping.items():
-            normalized[key] = str(tgt)
-        recorder.conds.append(
-            RecordedConditional(
-                source=source, chooser_qualname=_qualname(chooser), mapping=normalized
+    class _RecordingStateGraph(StateGraph):  # type: ignore[misc, valid-type]
+        def add_node(self, node: Any, action: Any = None, **kwargs: Any) -> Any:
+            name = node if isinstance(node, str) else getattr(node, "__name__", node)
+            fn = node if action is None else action
+            recorder.add_node(
+                RecordedNode(name=str(name), function_qualname=_qualname(fn))
             )
-        )
-        return orig_add_conditional_edges(self, source, chooser, mapping)
-
-    def set_entry_point(self: Any, name: str) -> None:  # type: ignore[override]
-        recorder.entrypoint = name
-        return orig_set_entry_point(self, name)
+            return super().add_node(node, action, **kwargs)
+
+        def add_edge(self, start_key: str | list[str], end_key: str) -> Any:
+            recorder.add_edge(RecordedEdge(source=str(start_key), target=str(end_key)))
+            return super().add_edge(start_key, end_key)
+
+        def add_conditional_edges(
+            self, source: str, path: Callable[..., Any], path_map: Any = None
+        ) -> Any:
+            if isinstance(path_map, dict):
+                normalized = {str(key): str(tgt) for key, tgt in path_map.items()}
+            else:
+                normalized = {str(tgt): str(tgt) for tgt in path_map or ()}
+            recorder.add_conditional(
+                RecordedConditional(
+                    source=source, chooser_qualname=_qualname(path), mapping=normalized
+                )
+            )
+            return super().add_conditional_edges(source, path, path_map)
 
-    # Monkey patch
-    StateGraph.add_node = add_node  # type: ignore[assignment]
-    StateGraph.add_edge = add_edge  # type: ignore[assignment]
-    StateGraph.add_conditional_edges = add_conditional_edges  # type: ignore[assignment]
-    StateGraph.set_entry_point = set_entry_point  # type: ignore[assignment]
+        def set_entry_point(self, key: str) -> Any:
+            recorder.entrypoint = key
+            return super().set_entry_point(key)
 
-    try:
-        yield recorder
-    finally:
-        # Restore
-        StateGraph.add_node = orig_add_node  # type: ignore[assignment]
-        StateGraph.add_edge = orig_add_edge  # type: ignore[assignment]
-        StateGraph.add_conditional_edges = orig_add_conditional_edges  # type: ignore[assignment]
-        StateGraph.set_entry_point = orig_set_entry_point  # type: ignore[assignment]
+    yield recorder, _RecordingStateGraph
 
 
 # --------------------
@@ -634,10 +967,13 @@ __all__ = [
     "Artifact",
     "Span",
     "span_context",
+    "enable",
+    "disable",
     "instrument_tool",
     "instrument_node",
     "STUBS",
-    "RECORDED_SPANS",
+    "drain_recorded_spans",
+    "to_unix_seconds",
     "record_stategraph_build",
     "RecordedGraph",
     "compile_with_checkpointer",